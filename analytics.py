@@ -0,0 +1,165 @@
+import threading
+import numpy as np
+from collections import OrderedDict
+
+# Days as they appear in the "days" field of a class time (e.g. "MWF", "TR")
+DAYS = ["M", "T", "W", "R", "F", "S", "U"]
+HOURS = 24
+
+# Aggregates for the most recently used dataset versions
+MAX_CACHED_VERSIONS = 8
+_cache = OrderedDict()
+# Sync endpoints run in a thread pool. _lock guards _cache, and each version
+# being computed has its own lock so only one thread flattens it.
+_lock = threading.Lock()
+_computing = {}
+
+
+def to_int(value):
+    """
+    Capacities are scraped as strings, anything non-numeric counts as 0.
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def to_hour(value):
+    """
+    Hour of a "HH:MM" time, -1 if it can't be read.
+    """
+    try:
+        hour = int(value.split(":")[0])
+    except (AttributeError, ValueError):
+        return -1
+    return hour if 0 <= hour < HOURS else -1
+
+
+def flatten(class_schedules, courses):
+    """
+    Flattens the class schedule tree into columnar arrays.
+
+    The subject of each course comes from courses.json, since course codes have
+    the spaces removed (ANSC101 is in subject AN SC).
+
+    Returns two tables (dicts of equal-length NumPy arrays):
+    sections - one row per section (subject, term, class_type, capacity)
+    meetings - one row per day a section meets (day, hour)
+    """
+    subjects, terms, class_types, capacities = [], [], [], []
+    days, hours = [], []
+
+    for course_code, course_terms in class_schedules.items():
+        # Courses that aren't offered (or failed to scrape) are stored as strings
+        if not isinstance(course_terms, dict) or course_code not in courses:
+            continue
+        subject = courses[course_code]["subject_code"]
+        for term_code, term in course_terms.items():
+            for class_type, sections in term.items():
+                for section in sections:
+                    subjects.append(subject)
+                    terms.append(term_code)
+                    class_types.append(class_type)
+                    capacities.append(to_int(section.get("capacity")))
+                    for pair in section.get("day_time_pairs", []):
+                        hour = to_hour(pair.get("start_time"))
+                        for day in pair.get("days", ""):
+                            if day in DAYS and hour >= 0:
+                                days.append(DAYS.index(day))
+                                hours.append(hour)
+
+    sections = {
+        "subject": np.array(subjects, dtype=str),
+        "term": np.array(terms, dtype=str),
+        "class_type": np.array(class_types, dtype=str),
+        "capacity": np.array(capacities, dtype=np.int64),
+    }
+    meetings = {
+        "day": np.array(days, dtype=np.int64),
+        "hour": np.array(hours, dtype=np.int64),
+    }
+    return sections, meetings
+
+
+def group_by(keys, weights=None):
+    """
+    Groups rows by the given key columns and sums the weights (or counts rows).
+
+    Returns a list of (key tuple, total) pairs.
+    """
+    if len(keys[0]) == 0:
+        return []
+    codes, labels = [], []
+    for column in keys:
+        label, code = np.unique(column, return_inverse=True)
+        labels.append(label)
+        codes.append(code)
+    group, group_code = np.unique(np.stack(codes, axis=1), axis=0, return_inverse=True)
+    totals = np.bincount(group_code.ravel(), weights=weights, minlength=len(group))
+    return [
+        (tuple(str(labels[i][code]) for i, code in enumerate(row)), int(total))
+        for row, total in zip(group, totals)
+    ]
+
+
+def capacity(sections):
+    """
+    Total seats per subject per term.
+    """
+    result = {}
+    for (subject, term), seats in group_by([sections["subject"], sections["term"]], sections["capacity"]):
+        result.setdefault(subject, {})[term] = seats
+    return result
+
+
+def section_counts(sections):
+    """
+    Number of sections per class type in each term.
+    """
+    result = {}
+    for (term, class_type), count in group_by([sections["term"], sections["class_type"]]):
+        result.setdefault(term, {})[class_type] = count
+    return result
+
+
+def heatmap(meetings):
+    """
+    Number of class meetings starting at each hour of each day of the week.
+    """
+    flat = meetings["day"] * HOURS + meetings["hour"]
+    grid = np.bincount(flat, minlength=len(DAYS) * HOURS).reshape(len(DAYS), HOURS)
+    return {day: grid[i].tolist() for i, day in enumerate(DAYS)}
+
+
+def load(version, open_class_schedules, open_courses):
+    """
+    Computes every aggregate for a version of the class schedules and courses, once per version.
+
+    open_class_schedules and open_courses are only called when the version isn't cached yet.
+    """
+    with _lock:
+        if version in _cache:
+            _cache.move_to_end(version)
+            return _cache[version]
+        version_lock = _computing.setdefault(version, threading.Lock())
+
+    with version_lock:
+        # Another thread may have computed it while this one waited
+        with _lock:
+            if version in _cache:
+                _cache.move_to_end(version)
+                return _cache[version]
+
+        sections, meetings = flatten(open_class_schedules(), open_courses())
+        aggregates = {
+            "capacity": capacity(sections),
+            "sections": section_counts(sections),
+            "heatmap": heatmap(meetings),
+        }
+        with _lock:
+            _cache[version] = aggregates
+            if len(_cache) > MAX_CACHED_VERSIONS:
+                _cache.popitem(last=False)
+            _computing.pop(version, None)
+    return aggregates
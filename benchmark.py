@@ -0,0 +1,511 @@
+import os
+import sys
+import json
+import socket
+import string
+import random
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from queue import Empty
+import requests
+import store
+from datetime import datetime
+from time import sleep, perf_counter
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Multiples of the real catalogue size. 100 can be asked for with --scales, but its
+# class_schedules.json is around 600 MB and loading it takes about 6 GB of memory
+SCALES = [1, 10]
+BASE_FACULTIES = 20     # Roughly what the scraper finds (see data/faculties.json)
+BASE_SUBJECTS = 327
+COURSES_PER_SUBJECT = 20
+
+TERMS = ["Fall2021", "Winter2022", "Spring2022", "Summer2022"]
+DAYS = ["MWF", "TR", "MW", "M", "T", "W", "R", "F"]
+ACADEMIC_YEARS = ["2020.2021", "2021.2022"]
+
+# (route, weight). Point lookups of popular courses make up most of the traffic
+REQUEST_MIX = [
+    ("/courses/{course_code}", 30),
+    ("/class_schedules/{course_code}/{term_code}", 15),
+    ("/class_schedules/lectures/{course_code}/{term_code}", 10),
+    ("/class_schedules/labs/{course_code}/{term_code}", 5),
+    ("/class_schedules/seminars/{course_code}/{term_code}", 3),
+    ("/class_schedules/{course_code}", 8),
+    ("/subjects/{subject_code}", 5),
+    ("/faculties/{faculty_code}", 3),
+    ("/v/{academic_year}/courses/{course_code}", 5),
+    ("/courses/{course_code}?as_of={as_of}", 2),
+    ("/analytics/capacity", 2),
+    ("/analytics/sections", 1),
+    ("/analytics/heatmap", 1),
+    ("/", 1),
+    ("/faculties", 1),
+    ("/subjects", 1),
+    ("/courses", 1),
+    ("/class_schedules/", 1),
+    ("/snapshots", 1),
+    ("/diff?from={from_year}&to={to_year}", 1),
+]
+
+# Relative change in a metric that counts as a regression when comparing to a baseline
+TOLERANCE = 0.2
+
+
+# *******************************************
+# Synthetic datasets
+# *******************************************
+def letters(number, width=5):
+    """
+    A code made only of letters, like real subject codes (0 -> AAAAA, 1 -> AAAAB).
+    """
+    code = ""
+    for _ in range(width):
+        number, digit = divmod(number, 26)
+        code = string.ascii_uppercase[digit] + code
+    return code
+
+
+def generate_section(rng, class_type, number):
+    """
+    One section in the same format as scraper.process_courses_for_class_schedules.
+    """
+    start_hour = rng.randint(8, 19)
+    length = rng.choice([50, 80, 170])
+    end_minutes = start_hour * 60 + length
+    return {
+        "section": f"{class_type[:3].upper()} {chr(ord('A') + number)}{number + 1}",
+        "code": str(rng.randint(10000, 99999)),
+        "capacity": str(rng.choice([24, 30, 48, 100, 150, 250, 400])),
+        "day_time_pairs": [{
+            "days": rng.choice(DAYS),
+            "start_time": f"{start_hour:02d}:00",
+            "end_time": f"{end_minutes // 60:02d}:{end_minutes % 60:02d}",
+        }],
+    }
+
+
+def generate_class_schedule(rng):
+    """
+    A class schedule for one course, or "not offered".
+    """
+    if rng.random() < 0.2:
+        return "not offered"
+    schedule = {}
+    for term_code in rng.sample(TERMS, rng.randint(1, 3)):
+        term = {"Lectures": [generate_section(rng, "Lecture", i) for i in range(rng.randint(1, 3))]}
+        if rng.random() < 0.5:
+            term["Labs"] = [generate_section(rng, "Lab", i) for i in range(rng.randint(1, 6))]
+        if rng.random() < 0.2:
+            term["Seminars"] = [generate_section(rng, "Seminar", i) for i in range(rng.randint(1, 2))]
+        schedule[term_code] = term
+    return schedule
+
+
+# Every record is made from its own seeded generator, so the datasets can be
+# written one record at a time and the codes used by requests can be worked out
+# again without keeping the datasets in memory.
+def catalogue(scale, seed=0):
+    """
+    The faculty codes, subject codes and (course code, subject code) pairs at a scale.
+    """
+    faculty_codes = [f"F{i:03d}" for i in range(BASE_FACULTIES * scale)]
+    subject_codes = [letters(i) for i in range(BASE_SUBJECTS * scale)]
+    courses = [
+        (f"{subject_code}{number}", subject_code)
+        for subject_code in subject_codes
+        for number in random.Random(f"{seed}-{subject_code}").sample(range(100, 700), COURSES_PER_SUBJECT)
+    ]
+    return faculty_codes, subject_codes, courses
+
+
+def class_schedule_for(course_code, year_number, seed=0):
+    """
+    The class schedule of a course in the year_number-th snapshot. About 5% of courses change every year.
+    """
+    changes = random.Random(f"{seed}-{course_code}-changes").random() < 0.05
+    version = year_number if changes else 0
+    return generate_class_schedule(random.Random(f"{seed}-{course_code}-{version}"))
+
+
+def course_for(course_code, subject_code, seed=0):
+    rng = random.Random(f"{seed}-{course_code}")
+    number = course_code[len(subject_code):]
+    return {
+        "course_name": f"Course {course_code}",
+        "course_link": f"https://apps.ualberta.ca/catalogue/course/{subject_code.lower()}/{number}",
+        "course_description": " ".join(rng.choice(["Topics", "include", "design", "analysis", "of", "systems"]) for _ in range(40)),
+        "course_units": "3",
+        "course_fee_index": "6",
+        "course_schedule": "EITHER",
+        "course_hrs_for_lecture": "3",
+        "course_hrs_for_seminar": "0",
+        "course_hrs_for_labtime": "3",
+        "course_prerequisites": f"Prerequisite: {subject_code} {int(number) - 1}",
+        "subject_code": subject_code,
+    }
+
+
+def write_streamed(file_name, records):
+    """
+    Writes (key, record) pairs as one json object without holding them all in memory.
+    """
+    with open(file_name, "w") as file:
+        file.write("{")
+        for number, (key, record) in enumerate(records):
+            file.write(",\n" if number else "\n")
+            file.write(f"{json.dumps(key)}: {json.dumps(record)}")
+        file.write("\n}")
+
+
+def generate(scale, data_root, seed=0):
+    """
+    Writes synthetic data/*.json files (and two snapshots) at scale times the catalogue size.
+    """
+    data_dir = os.path.join(data_root, "data")
+    os.makedirs(data_dir, exist_ok=True)
+    faculty_codes, subject_codes, courses = catalogue(scale, seed)
+
+    write_streamed(os.path.join(data_dir, "faculties.json"), (
+        (code, {"faculty_name": f"Faculty {code}", "faculty_link": f"https://apps.ualberta.ca/catalogue/faculty/{code.lower()}"})
+        for code in faculty_codes
+    ))
+    write_streamed(os.path.join(data_dir, "subjects.json"), (
+        (code, {
+            "name": f"Subject {code}",
+            "link": f"https://apps.ualberta.ca/catalogue/course/{code.lower()}",
+            "faculties": random.Random(f"{seed}-{code}").sample(faculty_codes, 2),
+        })
+        for code in subject_codes
+    ))
+    write_streamed(os.path.join(data_dir, "courses.json"), (
+        (course_code, course_for(course_code, subject_code, seed))
+        for course_code, subject_code in courses
+    ))
+
+    # Snapshots are read from data/store relative to the working directory, like the API
+    cwd = os.getcwd()
+    os.chdir(data_root)
+    try:
+        for year_number, academic_year in enumerate(ACADEMIC_YEARS):
+            write_streamed(os.path.join(data_dir, "class_schedules.json"), (
+                (course_code, class_schedule_for(course_code, year_number, seed))
+                for course_code, _ in courses
+            ))
+            store.snapshot(academic_year)
+    finally:
+        os.chdir(cwd)
+
+
+def request_paths(scale, count, seed=0):
+    """
+    A list of count request paths following REQUEST_MIX.
+    """
+    rng = random.Random(seed)
+    faculty_codes, subject_codes, courses = catalogue(scale, seed)
+    course_codes = [course_code for course_code, _ in courses]
+    # Popular courses get asked for much more often than the rest
+    rng.shuffle(course_codes)
+    course_weights = [1 / (rank + 1) for rank in range(len(course_codes))]
+    last_year = len(ACADEMIC_YEARS) - 1
+
+    routes, weights = zip(*REQUEST_MIX)
+    paths = []
+    for route, course_code in zip(
+        rng.choices(routes, weights=weights, k=count),
+        rng.choices(course_codes, weights=course_weights, k=count),
+    ):
+        schedule = class_schedule_for(course_code, last_year, seed) if "{term_code}" in route else None
+        paths.append(route.format(
+            course_code=course_code,
+            term_code=rng.choice(list(schedule) if isinstance(schedule, dict) else TERMS),
+            subject_code=rng.choice(subject_codes),
+            faculty_code=rng.choice(faculty_codes),
+            academic_year=rng.choice(ACADEMIC_YEARS),
+            as_of=datetime.utcnow().date().isoformat(),
+            from_year=ACADEMIC_YEARS[0],
+            to_year=ACADEMIC_YEARS[-1],
+        ))
+    return paths
+
+
+# *******************************************
+# Running requests
+# *******************************************
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def count_statuses(statuses):
+    counts = {}
+    for status in statuses:
+        counts[str(status)] = counts.get(str(status), 0) + 1
+    return dict(sorted(counts.items()))
+
+
+def summarize(paths, latencies, statuses, elapsed, peak_rss_kb):
+    """
+    p50/p99 latency in ms, requests per second, status codes and peak RSS in MB, overall and per route.
+
+    Requests for terms of courses that aren't offered get a 404 on purpose, so
+    those are counted apart from server errors.
+    """
+    by_route = {}
+    for path, latency, status in zip(paths, latencies, statuses):
+        route_latencies, route_statuses = by_route.setdefault(route_for(path), ([], []))
+        route_latencies.append(latency)
+        route_statuses.append(status)
+    return {
+        "requests": len(latencies),
+        "not_found": sum(status == 404 for status in statuses),
+        "server_errors": sum(status >= 500 for status in statuses),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 2),
+        "peak_rss_mb": round(peak_rss_kb / 1024, 1) if peak_rss_kb else None,
+        "routes": {
+            route: {
+                "requests": len(route_latencies),
+                "status_codes": count_statuses(route_statuses),
+                "p50_ms": round(percentile(route_latencies, 0.50) * 1000, 3),
+                "p99_ms": round(percentile(route_latencies, 0.99) * 1000, 3),
+            }
+            for route, (route_latencies, route_statuses) in sorted(by_route.items())
+        },
+    }
+
+
+def route_for(path):
+    """
+    The REQUEST_MIX route a path was made from.
+    """
+    path_parts = path.split("?")[0].strip("/").split("/")
+    for route, _ in REQUEST_MIX:
+        route_parts = route.split("?")[0].strip("/").split("/")
+        if len(route_parts) == len(path_parts) and all(
+            route_part.startswith("{") or route_part == path_part
+            for route_part, path_part in zip(route_parts, path_parts)
+        ):
+            if ("?" in route) == ("?" in path):
+                return route
+    return path
+
+
+def run_in_process(data_root, paths, results):
+    """
+    Sends every request through FastAPI's TestClient, in a spawned process so
+    its peak RSS only counts the API.
+    """
+    import resource
+    os.chdir(data_root)
+    sys.path.insert(0, REPO_DIR)
+    from fastapi.testclient import TestClient
+    import main
+
+    # Errors come back as 500 responses instead of being raised here
+    client = TestClient(main.app, raise_server_exceptions=False)
+    latencies = []
+    statuses = []
+    start = perf_counter()
+    for path in paths:
+        request_start = perf_counter()
+        response = client.get(path)
+        latencies.append(perf_counter() - request_start)
+        statuses.append(response.status_code)
+    elapsed = perf_counter() - start
+    results.put(summarize(paths, latencies, statuses, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def run_spawned(target, *args):
+    """
+    Runs target(*args, results) in a fresh spawned process and returns what it put in results.
+
+    A spawned process doesn't share the parent's memory, unlike a forked one.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=target, args=(*args, results))
+    process.start()
+    try:
+        while True:
+            try:
+                return results.get(timeout=1)
+            except Empty:
+                if not process.is_alive():
+                    break
+        # It may have finished just after the last check
+        try:
+            return results.get(timeout=1)
+        except Empty:
+            raise RuntimeError(f"{target.__name__} exited with code {process.exitcode} without a result")
+    finally:
+        process.join()
+
+
+def generate_spawned(scale, data_root, seed, results):
+    generate(scale, data_root, seed)
+    results.put(True)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def peak_rss_kb(pid):
+    """
+    Peak RSS of another process, from /proc (Linux only).
+    """
+    try:
+        with open(f"/proc/{pid}/status", "r") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def run_uvicorn(data_root, paths, concurrency):
+    """
+    Sends every request to main.py served by a local uvicorn, concurrency at a time.
+    """
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", REPO_DIR,
+         "--port", str(port), "--log-level", "warning"],
+        cwd=data_root,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        for _ in range(100):
+            if server.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {server.returncode} before serving any requests")
+            try:
+                requests.get(base_url + "/", timeout=1)
+                break
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                sleep(0.1)
+        else:
+            raise RuntimeError(f"uvicorn did not answer on {base_url} within 10 seconds")
+
+        # One keep-alive session per client thread
+        local = threading.local()
+
+        def timed_get(path):
+            if not hasattr(local, "session"):
+                local.session = requests.Session()
+            session = local.session
+            request_start = perf_counter()
+            response = session.get(base_url + path)
+            return perf_counter() - request_start, response.status_code
+
+        start = perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies, statuses = zip(*executor.map(timed_get, paths))
+        elapsed = perf_counter() - start
+        return summarize(paths, latencies, statuses, elapsed, peak_rss_kb(server.pid))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+# *******************************************
+# Baselines
+# *******************************************
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Metrics that got worse than the baseline by more than tolerance.
+    """
+    previous = {(run["scale"], run["mode"]): run for run in baseline["results"]}
+    regressions = []
+    for run in results:
+        before = previous.get((run["scale"], run["mode"]))
+        if before is None:
+            continue
+        for metric, higher_is_better in [("p50_ms", False), ("p99_ms", False), ("requests_per_second", True), ("peak_rss_mb", False)]:
+            old, new = before.get(metric), run.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                regressions.append(f"{run['mode']} {run['scale']}x {metric}: {old} -> {new} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test main.py with synthetic datasets.")
+    parser.add_argument("--scales", default=",".join(map(str, SCALES)), help="Catalogue size multiples, e.g. 1,10")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scale and mode")
+    parser.add_argument("--concurrency", type=int, default=8, help="Parallel clients against uvicorn")
+    parser.add_argument("--modes", default="in_process,uvicorn")
+    parser.add_argument("--output", default="benchmark.json", help="Where to write the results")
+    parser.add_argument("--baseline", help="Earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if "in_process" in args.modes.split(","):
+        # Newer versions of starlette need httpx for TestClient
+        try:
+            import fastapi.testclient  # noqa: F401
+        except RuntimeError:
+            sys.exit("The in_process mode needs httpx for FastAPI's TestClient. "
+                     "Install it with pip install -r requirements.txt, or run with --modes uvicorn.")
+
+    results = []
+    for scale in [int(scale) for scale in args.scales.split(",")]:
+        with tempfile.TemporaryDirectory() as data_root:
+            print(f"Generating {scale}x dataset...")
+            # Generated in its own process so this one stays small
+            run_spawned(generate_spawned, scale, data_root, args.seed)
+            paths = request_paths(scale, args.requests, args.seed)
+
+            for mode in args.modes.split(","):
+                print(f"Running {args.requests} requests ({mode}, {scale}x)...")
+                if mode == "in_process":
+                    summary = run_spawned(run_in_process, data_root, paths)
+                else:
+                    summary = run_uvicorn(data_root, paths, args.concurrency)
+                summary = {"scale": scale, "mode": mode, **summary}
+                print(f"  p50 {summary['p50_ms']}ms  p99 {summary['p99_ms']}ms  "
+                      f"{summary['requests_per_second']} req/s  peak RSS {summary['peak_rss_mb']}MB  "
+                      f"{summary['not_found']} not found  {summary['server_errors']} server errors")
+                results.append(summary)
+
+    with open(args.output, "w") as file:
+        json.dump({
+            "created": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "results": results,
+        }, file, indent=4)
+    print(f"Saved results to {args.output}")
+
+    failed = [f"{run['mode']} {run['scale']}x" for run in results if run["server_errors"]]
+    if failed:
+        print(f"Server errors in: {', '.join(failed)}")
+        sys.exit(1)
+
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
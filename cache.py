@@ -0,0 +1,71 @@
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    Least recently used cache of encoded responses, limited by total size and number of entries.
+
+    Keys are (route, params, dataset version) so a new version of the data never
+    gets an old response.
+    """
+
+    def __init__(self, max_bytes, max_entries):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        # Sync endpoints run in a thread pool
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        The cached body for key, or None.
+        """
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body):
+        """
+        Cache a body, evicting the least recently used ones until it fits.
+        """
+        if len(body) > self.max_bytes or self.max_entries <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size -= len(self._entries.pop(key))
+            self._entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes or len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def invalidate(self, version):
+        """
+        Drop every response built from a version of a dataset that was reloaded.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key[-1] == version]:
+                self.size -= len(self._entries.pop(key))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
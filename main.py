@@ -1,7 +1,14 @@
+import os
+import re
 import json
 import uvicorn
-from fastapi import FastAPI, HTTPException
+import analytics
+import store
+from cache import ResponseCache
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse
 from typing import Optional
+from urllib.parse import urlencode
 
 
 app = FastAPI(
@@ -10,6 +17,14 @@ app = FastAPI(
     version="2020.2021", # The Year it was scraped
 )
 
+# Encoded responses of point lookups (e.g. /courses/{course_code}), per dataset version
+response_cache = ResponseCache(
+    max_bytes=int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+    max_entries=int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 50000)),
+)
+# The last version seen of each dataset in data/, to notice when it gets reloaded
+file_versions = {}
+
 def open_and_return(file_name):
     """
     Open the file and return what's in it.
@@ -19,6 +34,78 @@ def open_and_return(file_name):
         return data
 
 
+def snapshot_for(academic_year, as_of):
+    """
+    The snapshot asked for with /v/{academic_year}/... or ?as_of=.
+    None means the current files in data/.
+    """
+    if academic_year is None and as_of is None:
+        return None
+    try:
+        return store.resolve(academic_year, as_of)
+    except LookupError:
+        raise HTTPException(status_code=404, detail="No data found for this academic year or date.")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="as_of must be a date (e.g. 2021-03-01).")
+
+
+def open_dataset(name, snapshot_id):
+    """
+    Open a dataset (faculties, subjects, courses or class_schedules) from a snapshot, or from data/.
+    """
+    if snapshot_id is None:
+        return open_and_return(f"data/{name}.json")
+    return store.load(snapshot_id, name)
+
+
+def dataset_version(name, snapshot_id):
+    """
+    Changes whenever the data behind open_dataset(name, snapshot_id) changes.
+    """
+    if snapshot_id is None:
+        return store.file_version(f"data/{name}.json")
+    return snapshot_id
+
+
+def cached_response(route, params, name, snapshot_id, build):
+    """
+    Serve a point lookup from the response cache.
+
+    On a miss the dataset is opened and build(dataset) makes the response, which
+    is encoded once and cached until the dataset changes.
+    """
+    version = dataset_version(name, snapshot_id)
+    if snapshot_id is None and file_versions.get(name) != version:
+        if name in file_versions:
+            response_cache.invalidate(file_versions[name])
+        file_versions[name] = version
+
+    key = (route, params, version)
+    body = response_cache.get(key)
+    if body is None:
+        body = JSONResponse(build(open_dataset(name, snapshot_id))).body
+        response_cache.put(key, body)
+    return Response(content=body, media_type="application/json")
+
+
+VERSION_PREFIX = re.compile(r"^/v/([^/]+)(/.*)$")
+
+@app.middleware("http")
+async def versioned_routes(request: Request, call_next):
+    """
+    Serve /v/{academic_year}/... with the regular endpoint and ?academic_year=.
+    """
+    match = VERSION_PREFIX.match(request.scope["path"])
+    if match:
+        academic_year, path = match.groups()
+        query_string = request.scope["query_string"]
+        version_query = urlencode({"academic_year": academic_year}).encode()
+        request.scope["path"] = path
+        request.scope["raw_path"] = path.encode()
+        request.scope["query_string"] = query_string + b"&" + version_query if query_string else version_query
+    return await call_next(request)
+
+
 @app.get("/", tags=["Endpoints"])
 def endpoints():
     """
@@ -31,7 +118,14 @@ def endpoints():
                 "/subjects",
                 "/subjects/{subject_code}",
                 "/courses/",
-                "/courses/{course_code}"
+                "/courses/{course_code}",
+                "/analytics/capacity",
+                "/analytics/sections",
+                "/analytics/heatmap",
+                "/snapshots",
+                "/diff",
+                "/cache",
+                "/v/{academic_year}/..."
             }}]
 
 
@@ -39,62 +133,67 @@ def endpoints():
 # Faculty-related enpoints
 # *******************************************
 @app.get("/faculties", tags=["Faculties"])
-def get_faculties():
+def get_faculties(academic_year: Optional[str] = None, as_of: Optional[str] = None):
     """
     The different faculties at the University.
     """
-    faculty_file = "data/faculties.json"
-    faculties = open_and_return(faculty_file)
+    snapshot_id = snapshot_for(academic_year, as_of)
+    faculties = open_dataset("faculties", snapshot_id)
     return [faculties]
 
 @app.get("/faculties/{faculty_code}", tags=["Faculties"])
-def get_faculty(faculty_code: str):
+def get_faculty(faculty_code: str, academic_year: Optional[str] = None, as_of: Optional[str] = None):
     """
     Get details about one faculty.
     """
-    faculty_file = "data/faculties.json"
-    faculties = open_and_return(faculty_file)
+    snapshot_id = snapshot_for(academic_year, as_of)
     faculty_code = faculty_code.upper()
-    if faculty_code not in faculties:
-        raise HTTPException(status_code=404, detail="Faculty not found")
-    return faculties[faculty_code]
+
+    def build(faculties):
+        if faculty_code not in faculties:
+            raise HTTPException(status_code=404, detail="Faculty not found")
+        return faculties[faculty_code]
+
+    return cached_response("/faculties/{faculty_code}", (faculty_code,), "faculties", snapshot_id, build)
 
 # *******************************************
 # Subject-related enpoints
 # *******************************************
 @app.get("/subjects", tags=["Subjects"])
-def get_subjects():
+def get_subjects(academic_year: Optional[str] = None, as_of: Optional[str] = None):
     """
     The different subjects at the university.
     """
-    subject_file = "data/subjects.json"
-    subjects = open_and_return(subject_file)
+    snapshot_id = snapshot_for(academic_year, as_of)
+    subjects = open_dataset("subjects", snapshot_id)
     return [subjects]
 
 
 @app.get("/subjects/{subject_code}", tags=["Subjects"])
-def get_subject(subject_code: str):
+def get_subject(subject_code: str, academic_year: Optional[str] = None, as_of: Optional[str] = None):
     """
     Get details about one subject.
     """
-    subject_file = "data/subjects.json"
-    subjects = open_and_return(subject_file)
-    
-    if subject_code not in subjects:
+    snapshot_id = snapshot_for(academic_year, as_of)
+
+    def build(subjects):
+        if subject_code not in subjects:
             raise HTTPException(status_code=404, detail="Subject not found")
-    return subjects[subject_code]
+        return subjects[subject_code]
+
+    return cached_response("/subjects/{subject_code}", (subject_code,), "subjects", snapshot_id, build)
 
 
 # *******************************************
 # Course-related enpoints
 # *******************************************
 @app.get("/courses", tags=["Courses"])
-def get_courses():
+def get_courses(academic_year: Optional[str] = None, as_of: Optional[str] = None):
     """
     Courses offered in 2020/2021 at the University of Alberta.
     """
-    course_file = "data/courses.json"
-    courses = open_and_return(course_file)
+    snapshot_id = snapshot_for(academic_year, as_of)
+    courses = open_dataset("courses", snapshot_id)
     try:
         return [courses]
     except:
@@ -102,17 +201,19 @@ def get_courses():
 
 
 @app.get("/courses/{course_code}", tags=["Courses"])
-def get_course(course_code: str):
+def get_course(course_code: str, academic_year: Optional[str] = None, as_of: Optional[str] = None):
     """
     Get details about one course.
     """
-    course_file = "data/courses.json"
-    courses = open_and_return(course_file)
+    snapshot_id = snapshot_for(academic_year, as_of)
     course_code = course_code.upper()
 
-    if course_code not in courses:
+    def build(courses):
+        if course_code not in courses:
             raise HTTPException(status_code=404, detail="Course not found. Make sure there is no space (e.g. CMPUT401 and not CMPUT 401)")
-    return courses[course_code]
+        return courses[course_code]
+
+    return cached_response("/courses/{course_code}", (course_code,), "courses", snapshot_id, build)
 
 
 # *******************************************
@@ -120,12 +221,12 @@ def get_course(course_code: str):
 # *******************************************
 
 @app.get("/class_schedules/", tags=["ClassSchedules"])
-def get_class_schedules():
+def get_class_schedules(academic_year: Optional[str] = None, as_of: Optional[str] = None):
     """
     Get all course data for an academic year
     """
-    class_schedules_file = "data/class_schedules.json"
-    class_schedules = open_and_return(class_schedules_file)
+    snapshot_id = snapshot_for(academic_year, as_of)
+    class_schedules = open_dataset("class_schedules", snapshot_id)
     try:
         return class_schedules
     except:
@@ -133,93 +234,189 @@ def get_class_schedules():
     
 
 @app.get("/class_schedules/{course_code}", tags=["ClassSchedules"])
-def get_class_schedule(course_code: str):
+def get_class_schedule(course_code: str, academic_year: Optional[str] = None, as_of: Optional[str] = None):
     """
     Get class schedule for a specific course.
     """
-    class_schedules_file = "data/class_schedules.json"
-    class_schedules = open_and_return(class_schedules_file)
+    snapshot_id = snapshot_for(academic_year, as_of)
     course_code = course_code.upper()
-    if course_code not in class_schedules:
-        raise HTTPException(status_code=404, detail="Course not found")
-    return class_schedules[course_code]
+
+    def build(class_schedules):
+        if course_code not in class_schedules:
+            raise HTTPException(status_code=404, detail="Course not found")
+        return class_schedules[course_code]
+
+    return cached_response("/class_schedules/{course_code}", (course_code,), "class_schedules", snapshot_id, build)
 
 
 @app.get("/class_schedules/{course_code}/{term_code}", tags=["ClassSchedules"])
-def get_class_schedule_for_term(term_code: str, course_code: str):
+def get_class_schedule_for_term(term_code: str, course_code: str, academic_year: Optional[str] = None, as_of: Optional[str] = None):
     """
     Get class schedule for a specific course in a specific term.
     """
-    class_schedules_file = "data/class_schedules.json"
-    class_schedules = open_and_return(class_schedules_file)
+    snapshot_id = snapshot_for(academic_year, as_of)
     course_code = course_code.upper()
 
-    if course_code not in class_schedules:
+    def build(class_schedules):
+        if course_code not in class_schedules:
             raise HTTPException(status_code=404, detail="Course not found")
-    if term_code not in class_schedules[course_code]:
+        if term_code not in class_schedules[course_code]:
             raise HTTPException(status_code=404, detail=f"{term_code} not found in {course_code}.")
-    return class_schedules[course_code][term_code]
+        return class_schedules[course_code][term_code]
+
+    return cached_response("/class_schedules/{course_code}/{term_code}", (course_code, term_code), "class_schedules", snapshot_id, build)
 
 
 @app.get("/class_schedules/lectures/{course_code}/{term_code}", tags=["ClassSchedules"])
-def get_lectures_for_course(course_code: str, term_code: str):
+def get_lectures_for_course(course_code: str, term_code: str, academic_year: Optional[str] = None, as_of: Optional[str] = None):
     """
     Get class data for lectures for a specific course in a specific term.
     """
-    class_schedules_file = "data/class_schedules.json"
-    class_schedules = open_and_return(class_schedules_file)
+    snapshot_id = snapshot_for(academic_year, as_of)
     course_code = course_code.upper()
     # term_code = term_code.upper()
 
-    if course_code not in class_schedules:
-        raise HTTPException(status_code=404, detail="Course not found")
-    if term_code not in class_schedules[course_code]:
-        raise HTTPException(status_code=404, detail=f"{course_code} not offered in {term_code}.")
+    def build(class_schedules):
+        if course_code not in class_schedules:
+            raise HTTPException(status_code=404, detail="Course not found")
+        if term_code not in class_schedules[course_code]:
+            raise HTTPException(status_code=404, detail=f"{course_code} not offered in {term_code}.")
 
-    try:
-        return class_schedules[course_code][term_code]["Lectures"]
-    except:
-        return {"detail": "No lectures for this course."}
+        try:
+            return class_schedules[course_code][term_code]["Lectures"]
+        except:
+            return {"detail": "No lectures for this course."}
+
+    return cached_response("/class_schedules/lectures/{course_code}/{term_code}", (course_code, term_code), "class_schedules", snapshot_id, build)
 
 
 @app.get("/class_schedules/labs/{course_code}/{term_code}", tags=["ClassSchedules"])
-def get_labs_for_course(course_code: str, term_code: str):
+def get_labs_for_course(course_code: str, term_code: str, academic_year: Optional[str] = None, as_of: Optional[str] = None):
     """
     Get class data for labs for a specific course in a specific term.
     """
-    class_schedules_file = "data/class_schedules.json"
-    class_schedules = open_and_return(class_schedules_file)
+    snapshot_id = snapshot_for(academic_year, as_of)
     course_code = course_code.upper()
     # term_code = term_code.upper()
 
-    if course_code not in class_schedules:
-        raise HTTPException(status_code=404, detail="Course not found")
-    if term_code not in class_schedules[course_code]:
-        raise HTTPException(status_code=404, detail=f"{course_code} not found in {term_code}.")
-    try:
-        return class_schedules[course_code][term_code]["Labs"]
-    except:
-        return {"detail": "No labs for this course."}
+    def build(class_schedules):
+        if course_code not in class_schedules:
+            raise HTTPException(status_code=404, detail="Course not found")
+        if term_code not in class_schedules[course_code]:
+            raise HTTPException(status_code=404, detail=f"{course_code} not found in {term_code}.")
+        try:
+            return class_schedules[course_code][term_code]["Labs"]
+        except:
+            return {"detail": "No labs for this course."}
+
+    return cached_response("/class_schedules/labs/{course_code}/{term_code}", (course_code, term_code), "class_schedules", snapshot_id, build)
 
 @app.get("/class_schedules/seminars/{course_code}/{term_code}", tags=["ClassSchedules"])
-def get_seminars_for_course(course_code: str, term_code: str):
+def get_seminars_for_course(course_code: str, term_code: str, academic_year: Optional[str] = None, as_of: Optional[str] = None):
     """
     Get class data for seminars for a specific course in a specific term.
     """
-    class_schedules_file = "data/class_schedules.json"
-    class_schedules = open_and_return(class_schedules_file)
+    snapshot_id = snapshot_for(academic_year, as_of)
     course_code = course_code.upper()
     # term_code = term_code.upper()
 
-    if course_code not in class_schedules:
-        raise HTTPException(status_code=404, detail="Course not found")
-    if term_code not in class_schedules[course_code]:
-        raise HTTPException(status_code=404, detail=f"{course_code} not offered in {term_code}.")
+    def build(class_schedules):
+        if course_code not in class_schedules:
+            raise HTTPException(status_code=404, detail="Course not found")
+        if term_code not in class_schedules[course_code]:
+            raise HTTPException(status_code=404, detail=f"{course_code} not offered in {term_code}.")
 
-    try:
-        return class_schedules[course_code][term_code]["Seminars"]
-    except:
-        return {"detail": "No Seminars for this course."}
+        try:
+            return class_schedules[course_code][term_code]["Seminars"]
+        except:
+            return {"detail": "No Seminars for this course."}
+
+    return cached_response("/class_schedules/seminars/{course_code}/{term_code}", (course_code, term_code), "class_schedules", snapshot_id, build)
+
+
+# *******************************************
+# Analytics-related enpoints
+# *******************************************
+def open_analytics(snapshot_id):
+    """
+    Aggregates over the class schedules, computed once per version of the class schedules and courses.
+    """
+    version = (dataset_version("class_schedules", snapshot_id), dataset_version("courses", snapshot_id))
+    return analytics.load(
+        version,
+        lambda: open_dataset("class_schedules", snapshot_id),
+        lambda: open_dataset("courses", snapshot_id),
+    )
+
+
+@app.get("/analytics/capacity", tags=["Analytics"])
+def get_capacity(term_code: Optional[str] = None, academic_year: Optional[str] = None, as_of: Optional[str] = None):
+    """
+    Total seats per subject per term.
+    """
+    snapshot_id = snapshot_for(academic_year, as_of)
+    capacity = open_analytics(snapshot_id)["capacity"]
+    if term_code is None:
+        return capacity
+    return {subject: terms[term_code] for subject, terms in capacity.items() if term_code in terms}
+
+
+@app.get("/analytics/sections", tags=["Analytics"])
+def get_section_counts(term_code: Optional[str] = None, academic_year: Optional[str] = None, as_of: Optional[str] = None):
+    """
+    Number of sections of each type (Lectures, Labs, Seminars) per term.
+    """
+    snapshot_id = snapshot_for(academic_year, as_of)
+    sections = open_analytics(snapshot_id)["sections"]
+    if term_code is None:
+        return sections
+    if term_code not in sections:
+        raise HTTPException(status_code=404, detail=f"{term_code} not found.")
+    return sections[term_code]
+
+
+@app.get("/analytics/heatmap", tags=["Analytics"])
+def get_heatmap(academic_year: Optional[str] = None, as_of: Optional[str] = None):
+    """
+    Number of class meetings starting at each hour (0-23) of each day of the week.
+    """
+    snapshot_id = snapshot_for(academic_year, as_of)
+    return open_analytics(snapshot_id)["heatmap"]
+
+
+# *******************************************
+# Snapshot-related enpoints
+# *******************************************
+@app.get("/snapshots", tags=["Snapshots"])
+def get_snapshots():
+    """
+    Every saved scrape, oldest first.
+    """
+    return [
+        {"snapshot_id": snapshot_id, "academic_year": academic_year, "scraped_at": scraped_at.isoformat()}
+        for snapshot_id, academic_year, scraped_at in store.snapshots()
+    ]
+
+
+@app.get("/diff", tags=["Snapshots"])
+def get_diff(from_version: str = Query(..., alias="from"), to_version: str = Query(..., alias="to")):
+    """
+    What was added, removed or changed between two academic years (or snapshot ids).
+    """
+    from_id = snapshot_for(from_version, None)
+    to_id = snapshot_for(to_version, None)
+    return {"from": from_id, "to": to_id, "changes": store.diff(from_id, to_id)}
+
+
+# *******************************************
+# Cache-related enpoints
+# *******************************************
+@app.get("/cache", tags=["Cache"])
+def get_cache_stats():
+    """
+    Size, hits, misses and evictions of the response cache.
+    """
+    return response_cache.stats()
 
 
 if __name__ == "__main__":
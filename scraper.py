@@ -2,9 +2,10 @@ import random
 import requests
 import json
 import re
+import store
 from bs4 import BeautifulSoup as bs
 from time import sleep, time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 
 ROOT_URL = "https://apps.ualberta.ca"
 MAIN_URL = "https://apps.ualberta.ca/catalogue"
@@ -113,20 +114,27 @@ def get_subjects(faculty_data):
         for future in as_completed(futures):
             faculty_subjects = future.result()
             for subject_code, subject_name, subject_url in faculty_subjects:
-                if subject_code not in subject_data:
-                    subject_data[subject_code] = {
-                        "name": subject_name,
-                        "link": subject_url,
-                        "faculties": []
-                    }
-                # Make sure each faculty is only added once
-                faculty_code = futures[future]
-                if faculty_code not in subject_data[subject_code]["faculties"]:
-                    subject_data[subject_code]["faculties"].append(faculty_code)
+                add_subject(subject_data, futures[future], subject_code, subject_name, subject_url)
 
     write_to_file('subjects', subject_data)
     return subject_data
 
+def add_subject(subject_data, faculty_code, subject_code, subject_name, subject_url):
+    """
+    Adds a subject found in a faculty. Returns True the first time the subject is seen.
+    """
+    is_new = subject_code not in subject_data
+    if is_new:
+        subject_data[subject_code] = {
+            "name": subject_name,
+            "link": subject_url,
+            "faculties": []
+        }
+    # Make sure each faculty is only added once
+    if faculty_code not in subject_data[subject_code]["faculties"]:
+        subject_data[subject_code]["faculties"].append(faculty_code)
+    return is_new
+
 def process_faculty_for_subjects(faculty_code, faculty_info):
     """Processes a single faculty to extract its subjects"""
     start_time = time()
@@ -192,24 +200,29 @@ def get_courses(subject_data):
         for future in as_completed(futures):
             subject_courses = future.result()
             for course in subject_courses:
-                course_code = course['course_code']
-                course_data[course_code] = {
-                    'course_name': course['course_name'],
-                    'course_link': course['course_link'],
-                    'course_description': course['course_description'],
-                    'course_units': course['course_units'],
-                    'course_fee_index': course['course_fee_index'],
-                    'course_schedule': course['course_schedule'],
-                    'course_hrs_for_lecture': course['course_hrs_for_lecture'],
-                    'course_hrs_for_seminar': course['course_hrs_for_seminar'],
-                    'course_hrs_for_labtime': course['course_hrs_for_labtime'],
-                    'course_prerequisites': course['course_prerequisites'],
-                    'subject_code': course['subject_code']
-                }
+                course_data[course['course_code']] = format_course(course)
 
     write_to_file('courses', course_data)
     return course_data
 
+def format_course(course):
+    """
+    The fields of a scraped course that get saved to courses.json.
+    """
+    return {
+        'course_name': course['course_name'],
+        'course_link': course['course_link'],
+        'course_description': course['course_description'],
+        'course_units': course['course_units'],
+        'course_fee_index': course['course_fee_index'],
+        'course_schedule': course['course_schedule'],
+        'course_hrs_for_lecture': course['course_hrs_for_lecture'],
+        'course_hrs_for_seminar': course['course_hrs_for_seminar'],
+        'course_hrs_for_labtime': course['course_hrs_for_labtime'],
+        'course_prerequisites': course['course_prerequisites'],
+        'subject_code': course['subject_code']
+    }
+
 def process_subjects_for_courses(subject_code, subject_info):
     """Processes a single subject to extract its courses"""
     start_time = time()
@@ -500,6 +513,64 @@ def process_courses_for_class_schedules(course_code, course_url):
         print(f"Error in {course_code}: {str(e)}")
         raise
 
+def crawl():
+    """
+    Scrapes faculties, subjects, courses and class schedules in one pass.
+
+    Instead of waiting for each stage to finish, every subject found is queued
+    for its course page straight away, and every course found is queued for
+    its schedule, all on the same pool. Subjects and courses that show up more
+    than once are only fetched once. Writes the same four json files as
+    running each stage on its own, then saves them as a new snapshot.
+    """
+    faculty_data = get_faculties()
+    if not faculty_data:
+        return
+
+    subject_data = {}
+    course_data = {}
+    class_schedules = {}
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        # future -> (stage, code) for everything that is still running
+        pending = {
+            executor.submit(process_faculty_for_subjects, faculty_code, faculty_info): ('faculty', faculty_code)
+            for faculty_code, faculty_info in faculty_data.items()
+        }
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, code = pending.pop(future)
+
+                if stage == 'faculty':
+                    for subject_code, subject_name, subject_url in future.result():
+                        if add_subject(subject_data, code, subject_code, subject_name, subject_url):
+                            subject_future = executor.submit(process_subjects_for_courses, subject_code, subject_data[subject_code])
+                            pending[subject_future] = ('subject', subject_code)
+
+                elif stage == 'subject':
+                    for course in future.result():
+                        course_code = course['course_code']
+                        if course_code not in course_data:
+                            schedule_future = executor.submit(process_courses_for_class_schedules, course_code, course['course_link'])
+                            pending[schedule_future] = ('course', course_code)
+                        course_data[course_code] = format_course(course)
+
+                else:
+                    try:
+                        result = future.result()
+                        if result:  # Ignore unsuccessful scrapes
+                            class_schedules[code] = result
+                    except Exception as e:
+                        print(f"Error processing {code}: {str(e)}")
+                        class_schedules[code] = "error"
+
+    write_to_file('subjects', subject_data)
+    write_to_file('courses', course_data)
+    write_to_file('class_schedules', class_schedules)
+    print(f"Saved snapshot {store.snapshot()}")
+
 def load_from_file(filename):
     """
     Loads data from a JSON file.
@@ -517,8 +588,12 @@ def load_from_file(filename):
 def main():
     '''
     Uncomment any of the blocks below to update a specific json data file (faculties, subjects, courses, class_schedules)
+    or the crawl block to update all of them in one pass
     '''
 
+    # print("Crawling Faculties, Subjects, Courses and Class Schedules...")
+    # crawl()
+
     # print("Scraping Faculties...")
     # faculty_data = get_faculties()
 
@@ -540,5 +615,9 @@ def main():
     # print("Scraping Class Schedules...")
     # class_schedules = get_class_schedules(course_data)
 
+    # Keep a copy of the json data files in the versioned store (data/store) so
+    # the next scrape doesn't overwrite them for good
+    # print(f"Saved snapshot {store.snapshot()}")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,264 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+DATA_DIR = "data"
+STORE_DIR = os.path.join(DATA_DIR, "store")
+PACKS_DIR = os.path.join(STORE_DIR, "packs")
+SNAPSHOTS_DIR = os.path.join(STORE_DIR, "snapshots")
+# hash -> [pack file, offset, length] of every record ever stored
+INDEX_PATH = os.path.join(STORE_DIR, "index.json")
+
+DATASETS = ["faculties", "subjects", "courses", "class_schedules"]
+
+# Limit on the datasets load() keeps in memory, counted in bytes of stored JSON.
+# The decoded datasets take several times that.
+LOADED_MAX_BYTES = int(os.environ.get("SNAPSHOT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+_loaded = OrderedDict()     # (snapshot_id, name) -> (size, dataset), least recently used first
+_loaded_size = 0
+_loaded_lock = threading.Lock()
+
+TIMESTAMP_FORMAT = "%Y%m%dT%H%M%SZ"
+
+
+def file_version(file_name):
+    """
+    Version of a plain dataset file. Changes whenever the file is rewritten.
+    """
+    stat = os.stat(file_name)
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+
+def current_academic_year(today=None):
+    """
+    The academic year for a date (E.g. 2020.2021). A new year starts on July 1st.
+    """
+    today = today or datetime.utcnow()
+    start = today.year if today.month >= 7 else today.year - 1
+    return f"{start}.{start + 1}"
+
+
+def record_hash(record):
+    """
+    Content hash of one record (E.g. one course).
+    """
+    encoded = json.dumps(record, sort_keys=True, separators=(",", ":")).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def read_index():
+    if not os.path.exists(INDEX_PATH):
+        return {}
+    with open(INDEX_PATH, "r") as file:
+        return json.load(file)
+
+
+def write_atomic(path, data):
+    """
+    Write json to a temporary file first so readers never see half a file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump(data, file)
+    os.replace(temp_path, path)
+
+
+def snapshot(academic_year=None, data_dir=DATA_DIR):
+    """
+    Saves the current data/*.json files as a new immutable snapshot and returns its id.
+
+    Every record is stored once under its content hash. Records that are new in
+    this snapshot are appended to one pack file per dataset, so records that did
+    not change since an earlier snapshot take no extra space.
+    """
+    academic_year = academic_year or current_academic_year()
+    scraped_at = datetime.utcnow()
+    snapshot_id = f"{academic_year}-{scraped_at.strftime(TIMESTAMP_FORMAT)}"
+    manifest_path = os.path.join(SNAPSHOTS_DIR, f"{snapshot_id}.json")
+    if os.path.exists(manifest_path):
+        raise FileExistsError(f"Snapshot {snapshot_id} already exists.")
+
+    index = read_index()
+    os.makedirs(PACKS_DIR, exist_ok=True)
+    datasets = {}
+    for name in DATASETS:
+        file_name = os.path.join(data_dir, f"{name}.json")
+        if not os.path.exists(file_name):
+            continue
+        with open(file_name, "r") as file:
+            data = json.load(file)
+
+        pack_name = f"{snapshot_id}-{name}.pack"
+        pack_path = os.path.join(PACKS_DIR, pack_name)
+        hashes = {}
+        offset = 0
+        with open(f"{pack_path}.tmp", "wb") as pack:
+            for key, record in data.items():
+                digest = record_hash(record)
+                if digest not in index:
+                    # Stored with its fields in the original order, unlike the hash
+                    encoded = json.dumps(record, separators=(",", ":")).encode()
+                    pack.write(encoded + b"\n")
+                    index[digest] = [pack_name, offset, len(encoded)]
+                    offset += len(encoded) + 1
+                hashes[key] = digest
+        if offset:
+            os.replace(f"{pack_path}.tmp", pack_path)
+        else:
+            os.remove(f"{pack_path}.tmp")
+        datasets[name] = hashes
+
+    # The manifest goes last, so a snapshot only shows up once all its records are saved
+    write_atomic(INDEX_PATH, index)
+    write_atomic(manifest_path, {
+        "academic_year": academic_year,
+        "scraped_at": scraped_at.strftime(TIMESTAMP_FORMAT),
+        "datasets": datasets,
+    })
+    return snapshot_id
+
+
+def snapshots_version():
+    """
+    Changes whenever a snapshot is added (the snapshots directory's mtime).
+    """
+    try:
+        return os.stat(SNAPSHOTS_DIR).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def snapshots():
+    """
+    All snapshots as (snapshot_id, academic_year, scraped_at), oldest first.
+    """
+    return list_snapshots(snapshots_version())
+
+
+@lru_cache(maxsize=1)
+def list_snapshots(directory_version):
+    """
+    Reads the snapshots directory once per version of it, so lookups don't list it on every request.
+    """
+    if directory_version is None:
+        return ()
+    found = []
+    for file_name in os.listdir(SNAPSHOTS_DIR):
+        if not file_name.endswith(".json"):
+            continue
+        snapshot_id = file_name[:-len(".json")]
+        academic_year, stamp = snapshot_id.rsplit("-", 1)
+        found.append((snapshot_id, academic_year, datetime.strptime(stamp, TIMESTAMP_FORMAT)))
+    return tuple(sorted(found, key=lambda found_snapshot: found_snapshot[2]))
+
+
+def parse_as_of(as_of):
+    """
+    The last moment an as_of value includes, in UTC like the snapshot times.
+    A plain date (2021-03-01) includes that whole day.
+    """
+    moment = datetime.fromisoformat(as_of)
+    if len(as_of) == len("YYYY-MM-DD"):
+        # Snapshot times are to the second
+        moment += timedelta(days=1, seconds=-1)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def resolve(version=None, as_of=None):
+    """
+    Finds the latest snapshot matching an academic year (or snapshot id) taken up to as_of.
+
+    Raises LookupError if there is no such snapshot and ValueError for a bad as_of.
+    """
+    return resolve_in(snapshots_version(), version, as_of)
+
+
+@lru_cache(maxsize=1024)
+def resolve_in(directory_version, version, as_of):
+    candidates = list_snapshots(directory_version)
+    if version is not None:
+        candidates = [found for found in candidates if version in (found[0], found[1])]
+    if as_of is not None:
+        moment = parse_as_of(as_of)
+        candidates = [found for found in candidates if found[2] <= moment]
+    if not candidates:
+        raise LookupError("Snapshot not found")
+    return candidates[-1][0]
+
+
+@lru_cache(maxsize=16)
+def manifest(snapshot_id):
+    """
+    The record hashes of a snapshot. Snapshots never change so this is cached.
+    """
+    with open(os.path.join(SNAPSHOTS_DIR, f"{snapshot_id}.json"), "r") as file:
+        return json.load(file)
+
+
+def load(snapshot_id, name):
+    """
+    Rebuilds one dataset (E.g. courses) as it was in a snapshot.
+
+    Each pack it needs is opened once and read in order. The most recently used
+    datasets are kept, up to LOADED_MAX_BYTES.
+    """
+    global _loaded_size
+    cached = (snapshot_id, name)
+    with _loaded_lock:
+        if cached in _loaded:
+            _loaded.move_to_end(cached)
+            return _loaded[cached][1]
+
+    index = read_index()
+    hashes = manifest(snapshot_id)["datasets"].get(name, {})
+    by_pack = {}
+    for digest in set(hashes.values()):
+        pack_name, offset, length = index[digest]
+        by_pack.setdefault(pack_name, []).append((offset, length, digest))
+
+    records = {}
+    size = 0
+    for pack_name, locations in by_pack.items():
+        with open(os.path.join(PACKS_DIR, pack_name), "rb") as pack:
+            for offset, length, digest in sorted(locations):
+                pack.seek(offset)
+                records[digest] = json.loads(pack.read(length))
+                size += length
+    data = {key: records[digest] for key, digest in hashes.items()}
+
+    if size <= LOADED_MAX_BYTES:
+        with _loaded_lock:
+            if cached not in _loaded:
+                _loaded[cached] = (size, data)
+                _loaded_size += size
+            while _loaded_size > LOADED_MAX_BYTES:
+                evicted_size, _ = _loaded.popitem(last=False)[1]
+                _loaded_size -= evicted_size
+    return data
+
+
+def diff(from_id, to_id):
+    """
+    Keys added, removed and changed in each dataset between two snapshots.
+
+    Only the hashes in the manifests are compared, records are never loaded.
+    """
+    before = manifest(from_id)["datasets"]
+    after = manifest(to_id)["datasets"]
+    changes = {}
+    for name in DATASETS:
+        old = before.get(name, {})
+        new = after.get(name, {})
+        changes[name] = {
+            "added": sorted(new.keys() - old.keys()),
+            "removed": sorted(old.keys() - new.keys()),
+            "changed": sorted(key for key in old.keys() & new.keys() if old[key] != new[key]),
+        }
+    return changes